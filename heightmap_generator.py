@@ -1,17 +1,85 @@
 import argparse
 import json
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import requests
 from typing import Any
 import numpy as np
 import OpenEXR
-from scipy import interpolate
-import re
+import string
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 URL_TEMPLATE = "https://deaddropgames.com/stuntski/api/levels/{id}"
 
+# Maximum number of concurrent requests when fetching several levels
+MAX_FETCH_WORKERS = 8
+
+# Deletes every ASCII character that is not allowed in a generated output file name
+_FILENAME_TABLE = str.maketrans(
+    "",
+    "",
+    "".join(
+        c
+        for c in map(chr, range(128))
+        if c not in string.ascii_lowercase + string.digits + "_"
+    ),
+)
+
+# EXR compression methods selectable from the command line
+EXR_COMPRESSION = {
+    "zip": OpenEXR.ZIP_COMPRESSION,
+    "none": OpenEXR.NO_COMPRESSION,
+}
+
+# EXR pixel types selectable from the command line; OpenEXR infers FLOAT or HALF
+# channels from the numpy dtype
+EXR_PRECISION = {
+    "float": np.float32,
+    "half": np.float16,
+}
+
+# One session per thread so repeated fetches share keep-alive connections;
+# requests does not guarantee a Session is safe to share between threads
+_SESSIONS = threading.local()
+
+
+def _get_session() -> requests.Session:
+    """
+    Get the requests session for the current thread, creating it on first use.
+
+    Returns:
+        requests.Session: Session owned by the calling thread
+    """
+    session = getattr(_SESSIONS, "session", None)
+    if session is None:
+        session = _SESSIONS.session = requests.Session()
+    return session
+
+
+def _json_loads(data: bytes) -> Any:
+    """
+    Decode JSON, using orjson when it is installed and the stdlib otherwise.
+
+    Args:
+        data: Raw JSON document
+
+    Returns:
+        Any: Decoded JSON data
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 
-def parse_polyline_from_json(json_data: dict[str, Any]) -> np.ndarray:
+def parse_polyline_from_json(
+    json_data: dict[str, Any],
+) -> tuple[np.ndarray, np.ndarray]:
     """
     Extract polyline points from JSON data.
 
@@ -19,20 +87,25 @@ def parse_polyline_from_json(json_data: dict[str, Any]) -> np.ndarray:
         json_data: Dictionary containing JSON data with polyline information
 
     Returns:
-        np.ndarray: Array of (x,y) coordinates
+        tuple: (np.ndarray: x-coordinates, np.ndarray: y-coordinates)
     """
     # Extract the points from the first polyline
     points_data: list[dict[str, float]] = json_data["polyLines"][0]["points"]
 
-    # Convert to list of (x,y) coordinates
-    points: list[tuple[float, float]] = [
-        (point.get("x", 0.0), point.get("y", 0.0)) for point in points_data
-    ]
+    # Stream the coordinates straight into separate contiguous arrays; these stay
+    # float64 so terrain extents and image dimensions are computed at full precision
+    n = len(points_data)
+    xs: np.ndarray = np.fromiter(
+        (point.get("x", 0.0) for point in points_data), dtype=np.float64, count=n
+    )
+    ys: np.ndarray = np.fromiter(
+        (point.get("y", 0.0) for point in points_data), dtype=np.float64, count=n
+    )
 
-    return np.array(points)
+    return xs, ys
 
 
-def read_polyline(file_path: str) -> tuple[np.ndarray, dict[str, Any]]:
+def read_polyline(file_path: str) -> tuple[np.ndarray, np.ndarray, dict[str, Any]]:
     """
     Read polyline data from JSON file.
 
@@ -43,15 +116,16 @@ def read_polyline(file_path: str) -> tuple[np.ndarray, dict[str, Any]]:
         file_path: Path to the JSON file
 
     Returns:
-        tuple: (np.ndarray: Array of (x,y) coordinates, dict: JSON data)
+        tuple: (np.ndarray: x-coordinates, np.ndarray: y-coordinates, dict: JSON data)
     """
-    with open(file_path, "r") as f:
-        json_data: dict[str, Any] = json.load(f)
+    with open(file_path, "rb") as f:
+        json_data: dict[str, Any] = _json_loads(f.read())
 
-    return parse_polyline_from_json(json_data), json_data
+    xs, ys = parse_polyline_from_json(json_data)
+    return xs, ys, json_data
 
 
-def fetch_polyline_from_url(id: int) -> tuple[np.ndarray, dict[str, Any]]:
+def fetch_polyline_from_url(id: int) -> tuple[np.ndarray, np.ndarray, dict[str, Any]]:
     """
     Fetch polyline data from a URL using an ID parameter.
 
@@ -59,70 +133,104 @@ def fetch_polyline_from_url(id: int) -> tuple[np.ndarray, dict[str, Any]]:
         id: ID to insert into the URL template
 
     Returns:
-        tuple: (np.ndarray: Array of (x,y) coordinates, dict: JSON data)
+        tuple: (np.ndarray: x-coordinates, np.ndarray: y-coordinates, dict: JSON data)
     """
     url = URL_TEMPLATE.format(id=id)
     print(f"Fetching data from {url}...")
 
-    response = requests.get(url)
+    response = _get_session().get(url, timeout=30)
     response.raise_for_status()  # Raise an exception if request failed
 
-    json_data: dict[str, Any] = response.json()
+    json_data: dict[str, Any] = _json_loads(response.content)
 
-    return parse_polyline_from_json(json_data), json_data
+    xs, ys = parse_polyline_from_json(json_data)
+    return xs, ys, json_data
+
+
+def _build_row(xs: np.ndarray, px: np.ndarray, py: np.ndarray) -> np.ndarray:
+    """
+    Interpolate a polyline at the given x-coordinates and normalize to 0-1.
+
+    Args:
+        xs: x-coordinates to sample
+        px: x-coordinates of the polyline, sorted ascending
+        py: y-coordinates of the polyline
+
+    Returns:
+        np.ndarray: Normalized heights, one per x-coordinate
+    """
+    # Clamp to the polyline so samples outside it take the end heights
+    xs = np.clip(xs, px[0], px[-1])
+
+    # Find the segment each sample falls in and blend linearly along it; unlike
+    # np.interp this stays in the input precision (float32)
+    idx: np.ndarray = np.searchsorted(px, xs, side="right").clip(1, len(px) - 1) - 1
+    x0: np.ndarray = px[idx]
+    y0: np.ndarray = py[idx]
+    dx: np.ndarray = px[idx + 1] - x0
+    # Vertical segments (repeated x) take the later point, matching the end clamp
+    t: np.ndarray = np.divide(xs - x0, dx, out=np.ones_like(xs), where=dx > 0)
+    row: np.ndarray = y0 + t * (py[idx + 1] - y0)
+
+    # Normalize to 0-1 range in place
+    h_min: float = np.min(row)
+    h_max: float = np.max(row)
+    if h_max > h_min:
+        # Multiply by the reciprocal of the range rather than dividing every element
+        inv_range = row.dtype.type(1.0 / (h_max - h_min))
+        np.subtract(row, h_min, out=row)
+        np.multiply(row, inv_range, out=row)
+
+    return row
 
 
 def create_heightmap(
-    polyline: np.ndarray, width: int = 1024, height: int = 1024
+    xs: np.ndarray, ys: np.ndarray, width: int = 1024, height: int = 1024
 ) -> np.ndarray:
     """
     Convert polyline to heightmap.
 
     Args:
-        polyline: Nx2 array of (x,y) coordinates
+        xs: x-coordinates of the polyline
+        ys: y-coordinates of the polyline
         width: Width of output heightmap
         height: Height of output heightmap
 
     Returns:
         np.ndarray: 2D array representing the heightmap
     """
-    # Find bounds of polyline
-    x_min, y_min = np.min(polyline, axis=0)
-    x_max, y_max = np.max(polyline, axis=0)
+    # This assumes polyline is ordered by x-coordinate (terrain profile)
+    # Sort by x-coordinate to ensure proper interpolation, unless it already is.
+    # Sort at full precision, since distinct x values can round to the same float32
+    if not np.all(np.diff(xs) >= 0):
+        sorted_indices: np.ndarray = np.argsort(xs)
+        xs, ys = xs[sorted_indices], ys[sorted_indices]
 
-    # Create grid for heightmap
-    x_coords: np.ndarray = np.linspace(x_min, x_max, width)
-    y_coords: np.ndarray = np.linspace(y_min, y_max, height)
-    grid_x, _ = np.meshgrid(x_coords, y_coords)
+    # Interpolate in float32, the precision of the EXR output
+    xs = xs.astype(np.float32)
+    ys = ys.astype(np.float32)
 
-    # Interpolate heights from polyline
-    # This assumes polyline is ordered by x-coordinate (terrain profile)
-    # Sort by x-coordinate to ensure proper interpolation
-    sorted_indices: np.ndarray = np.argsort(polyline[:, 0])
-    sorted_polyline: np.ndarray = polyline[sorted_indices]
-
-    # Create interpolation function
-    f = interpolate.interp1d(
-        sorted_polyline[:, 0],
-        sorted_polyline[:, 1],
-        kind="linear",
-        bounds_error=False,
-        fill_value=(sorted_polyline[0, 1], sorted_polyline[-1, 1]),
-    )
+    # Bounds of a sorted polyline are its end points, no reduction needed
+    x_min: float = xs[0]
+    x_max: float = xs[-1]
 
-    # Generate heightmap
-    heightmap: np.ndarray = f(grid_x)
+    # Every row of the heightmap is identical, so only sample a single row
+    x_coords: np.ndarray = np.linspace(x_min, x_max, width, dtype=np.float32)
 
-    # Normalize to 0-1 range
-    h_min: float = np.min(heightmap)
-    h_max: float = np.max(heightmap)
-    if h_max > h_min:
-        heightmap = (heightmap - h_min) / (h_max - h_min)
+    # Interpolate heights from polyline
+    row: np.ndarray = _build_row(x_coords, xs, ys)
 
-    return heightmap
+    # Repeat the row for every scanline without copying it
+    return np.broadcast_to(row, (height, width))
 
 
-def save_exr(heightmap: np.ndarray, output_path: str, metadata: dict = None) -> None:
+def save_exr(
+    heightmap: np.ndarray,
+    output_path: str,
+    metadata: dict = None,
+    compression: str = "zip",
+    precision: str = "float",
+) -> None:
     """
     Save heightmap as EXR file using OpenEXR with optional metadata
 
@@ -130,12 +238,18 @@ def save_exr(heightmap: np.ndarray, output_path: str, metadata: dict = None) ->
         heightmap: 2D numpy array with heightmap data
         output_path: Path where to save the EXR file
         metadata: Optional dictionary of metadata to include in the EXR file
+        compression: Compression method, one of the keys of EXR_COMPRESSION
+        precision: Pixel type, one of the keys of EXR_PRECISION
     """
-    # Convert to float32
-    heightmap_float32 = heightmap.astype(np.float32)
-
-    channels = {"R": heightmap_float32}
-    header = {"compression": OpenEXR.ZIP_COMPRESSION, "type": OpenEXR.scanlineimage}
+    # OpenEXR needs a C-contiguous buffer of the pixel type; this only copies when
+    # the input is not one already (e.g. broadcast views are materialized here, once)
+    pixels = np.ascontiguousarray(heightmap, dtype=EXR_PRECISION[precision])
+
+    channels = {"R": pixels}
+    header = {
+        "compression": EXR_COMPRESSION[compression],
+        "type": OpenEXR.scanlineimage,
+    }
     # Add metadata if provided
     if metadata:
         for key, value in metadata.items():
@@ -147,24 +261,21 @@ def save_exr(heightmap: np.ndarray, output_path: str, metadata: dict = None) ->
 
 
 def calculate_optimal_dimensions(
-    polyline: np.ndarray, pixels_per_meter: float = 1.0, height: int = 1024
+    xs: np.ndarray, pixels_per_meter: float = 1.0, height: int = 1024
 ) -> tuple[int, int]:
     """
     Calculate optimal width based on terrain extent, with fixed or specified height.
 
     Args:
-        polyline: Nx2 array of (x,y) coordinates
+        xs: x-coordinates of the polyline
         pixels_per_meter: Optional resolution in pixels per meter
         height: Image height to use for the heightmap
 
     Returns:
         tuple[int, int]: Width and height in pixels
     """
-    # Find bounds of polyline
-    x_min, x_max = np.min(polyline[:, 0]), np.max(polyline[:, 0])
-
     # Calculate terrain width in meters
-    terrain_width = x_max - x_min
+    terrain_width = np.ptp(xs)
 
     # Calculate width based on pixels per meter or use target width
     width = int(terrain_width * pixels_per_meter)
@@ -172,6 +283,176 @@ def calculate_optimal_dimensions(
     return width, height
 
 
+def parse_identifiers(value: str) -> list[int]:
+    """
+    Parse a comma-separated list of level IDs from the command line.
+
+    Args:
+        value: Comma-separated IDs, e.g. "1,2,3"
+
+    Returns:
+        list[int]: Parsed IDs, in order with duplicates removed
+    """
+    try:
+        ids = [int(part) for part in value.split(",") if part.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid ID list: '{value}'")
+
+    if not ids:
+        raise argparse.ArgumentTypeError(f"no IDs given: '{value}'")
+
+    # Duplicate IDs would write the same output files from concurrent workers
+    return list(dict.fromkeys(ids))
+
+
+def level_file_name(json_data: dict[str, Any]) -> str:
+    """
+    Build a file name (without extension) from the level name in the JSON data.
+
+    Args:
+        json_data: JSON data the polyline was read from
+
+    Returns:
+        str: Cleaned level name, or "heightmap" if nothing usable is left
+    """
+    raw_name = json_data.get("name", "heightmap").lower()
+    # Replace whitespace runs with underscores, then remove everything except
+    # ASCII lowercase letters, digits and underscores
+    level_name = (
+        "_".join(raw_name.split())
+        .encode("ascii", "ignore")
+        .decode("ascii")
+        .translate(_FILENAME_TABLE)
+    )
+    return level_name or "heightmap"
+
+
+def generate_heightmap(
+    xs: np.ndarray,
+    ys: np.ndarray,
+    json_data: dict[str, Any],
+    output: str | None = None,
+    pixels_per_meter: float = 1.0,
+    height: int = 1024,
+    compression: str = "zip",
+    precision: str = "float",
+) -> str:
+    """
+    Create a heightmap from polyline data and save it to the out directory.
+
+    Args:
+        xs: x-coordinates of the polyline
+        ys: y-coordinates of the polyline
+        json_data: JSON data the polyline was read from
+        output: Output EXR file name, or None to derive it from the level name
+        pixels_per_meter: Resolution in pixels per meter
+        height: Height of output heightmap
+        compression: EXR compression method, one of the keys of EXR_COMPRESSION
+        precision: EXR pixel type, one of the keys of EXR_PRECISION
+
+    Returns:
+        str: Path of the saved EXR file
+    """
+    # if no output file name was given, use the name in the json data, but clean the name
+    if output is None:
+        level_name = level_file_name(json_data)
+        output = f"{level_name}.exr"
+        print(f"Output file name set to '{output}' based on level name '{level_name}'")
+
+    # Ensure output directory exists and update output paths
+    out_dir = os.path.join(os.getcwd(), "out")
+    os.makedirs(out_dir, exist_ok=True)
+    output_exr_path = os.path.join(out_dir, output)
+    output_json_path = os.path.splitext(output_exr_path)[0] + ".json"
+
+    print(f"Found {len(xs)} points in polyline")
+
+    # Print out the delta x and y values
+    delta_x = np.ptp(xs)
+    delta_y = np.ptp(ys)
+    print(f"Delta X: {delta_x}, Delta Y: {delta_y}")
+
+    # Derive the image width from the terrain extent
+    print("Calculating optimal dimensions based on terrain aspect ratio...")
+    width, height = calculate_optimal_dimensions(
+        xs, pixels_per_meter=pixels_per_meter, height=height
+    )
+    print(f"Using calculated dimensions: {width}x{height}")
+
+    print(f"Creating heightmap ({width}x{height})...")
+    heightmap: np.ndarray = create_heightmap(xs, ys, width=width, height=height)
+
+    # Create metadata dictionary with terrain dimensions
+    metadata = {  # openEXR attributes are camelCase, prefix with ddg to namespace them (DeadDropGames)
+        "ddgTerrainWidth": abs(float(delta_x)),
+        "ddgTerrainHeight": abs(float(delta_y)),
+        "ddgPixelsPerMeter": pixels_per_meter,
+    }
+
+    # save the metadata to a json file in the out directory
+    with open(output_json_path, "w") as f:
+        json.dump(metadata, f, indent=4)
+
+    print(f"Saving heightmap to '{output_exr_path}'...")
+    save_exr(
+        heightmap,
+        output_exr_path,
+        metadata,
+        compression=compression,
+        precision=precision,
+    )
+
+    print(f"Done! Heightmap saved to '{output_exr_path}'")
+    return output_exr_path
+
+
+def generate_heightmaps_from_urls(identifiers: list[int], **kwargs: Any) -> None:
+    """
+    Fetch several levels concurrently and generate their heightmaps in parallel.
+
+    Downloads run in a thread pool while finished downloads are handed to a process
+    pool for the CPU-bound heightmap generation, so network waits overlap compute.
+    Output files are named after each level with its ID appended, since different
+    levels can share a name (or have none) and workers would overwrite each other.
+
+    Args:
+        identifiers: IDs to insert into the URL template
+        **kwargs: Additional keyword arguments passed to generate_heightmap
+    """
+    with (
+        ThreadPoolExecutor(
+            max_workers=min(MAX_FETCH_WORKERS, len(identifiers))
+        ) as fetch_pool,
+        # Spawn rather than fork workers, since the fetch threads are already running
+        ProcessPoolExecutor(
+            max_workers=min(os.cpu_count() or 1, len(identifiers)),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as generate_pool,
+    ):
+        fetches = {
+            fetch_pool.submit(fetch_polyline_from_url, id): id for id in identifiers
+        }
+        jobs = {}
+        for fetch in as_completed(fetches):
+            id = fetches[fetch]
+            try:
+                xs, ys, json_data = fetch.result()
+            except Exception as e:
+                print(f"Error fetching data for ID {id}: {e}")
+                continue
+            output = f"{level_file_name(json_data)}_{id}.exr"
+            job = generate_pool.submit(
+                generate_heightmap, xs, ys, json_data, output, **kwargs
+            )
+            jobs[job] = id
+
+        for job in as_completed(jobs):
+            try:
+                job.result()
+            except Exception as e:
+                print(f"Error creating heightmap for ID {jobs[job]}: {e}")
+
+
 def main() -> None:
     """
     Main function to parse arguments and process the heightmap
@@ -186,7 +467,10 @@ def main() -> None:
         "-i", "--input", help="Input JSON file containing polyline data"
     )
     input_group.add_argument(
-        "-id", "--identifier", type=int, help="ID to use with URL template"
+        "-id",
+        "--identifier",
+        type=parse_identifiers,
+        help="ID, or comma-separated IDs, to use with URL template",
     )
 
     # NOTE: if this parameter is omitted, we'll default to a name created from the JSON data
@@ -207,19 +491,47 @@ def main() -> None:
         help="Height of output heightmap (default: 1024)",
     )
 
+    parser.add_argument(
+        "-c",
+        "--compression",
+        choices=list(EXR_COMPRESSION),
+        default="zip",
+        help="EXR compression; 'none' writes faster during iteration (default: zip)",
+    )
+
+    parser.add_argument(
+        "--precision",
+        choices=list(EXR_PRECISION),
+        default="float",
+        help="EXR pixel type; 'half' halves the file size (default: float)",
+    )
+
     args = parser.parse_args()
 
+    output = None if args.output == default_output_name else args.output
+    options = {
+        "pixels_per_meter": args.ppm,
+        "height": args.height,
+        "compression": args.compression,
+        "precision": args.precision,
+    }
+
     # Get polyline data either from file or URL
     if args.input:
-        if not os.path.exists(args.input):
+        print(f"Reading polyline from '{args.input}'...")
+        try:
+            xs, ys, json_data = read_polyline(args.input)
+        except FileNotFoundError:
             print(f"Error: Input file '{args.input}' not found.")
             return
-
-        print(f"Reading polyline from '{args.input}'...")
-        polyline, json_data = read_polyline(args.input)
-    elif args.identifier is not None:
+    elif args.identifier and len(args.identifier) > 1:
+        if output is not None:
+            parser.error("-o/--output cannot be used with multiple identifiers")
+        generate_heightmaps_from_urls(args.identifier, **options)
+        return
+    elif args.identifier:
         try:
-            polyline, json_data = fetch_polyline_from_url(args.identifier)
+            xs, ys, json_data = fetch_polyline_from_url(args.identifier[0])
         except Exception as e:
             print(f"Error fetching data: {e}")
             return
@@ -227,56 +539,7 @@ def main() -> None:
         parser.print_help()
         return
 
-    # if the output file name is the default, change it to the name in the json data, but clean the name
-    if args.output == default_output_name:
-        raw_name = json_data.get("name", "heightmap").lower()
-        # Replace spaces with underscores, then remove all non-alphanumeric/underscore
-        level_name = re.sub(r"[^a-z0-9_]", "", re.sub(r"\s+", "_", raw_name))
-        args.output = f"{level_name}.exr"
-        print(
-            f"Output file name set to '{args.output}' based on level name '{level_name}'"
-        )
-
-    # Ensure output directory exists and update output paths
-    out_dir = os.path.join(os.getcwd(), "out")
-    os.makedirs(out_dir, exist_ok=True)
-    output_exr_path = os.path.join(out_dir, args.output)
-    output_json_path = os.path.splitext(output_exr_path)[0] + ".json"
-
-    print(f"Found {len(polyline)} points in polyline")
-
-    # Print out the delta x and y values
-    delta_x = np.max(polyline[:, 0]) - np.min(polyline[:, 0])
-    delta_y = np.max(polyline[:, 1]) - np.min(polyline[:, 1])
-    print(f"Delta X: {delta_x}, Delta Y: {delta_y}")
-
-    # In main function where dimensions are processed
-    print("Calculating optimal dimensions based on terrain aspect ratio...")
-    args.width, args.height = calculate_optimal_dimensions(
-        polyline, pixels_per_meter=args.ppm, height=args.height
-    )
-    print(f"Using calculated dimensions: {args.width}x{args.height}")
-
-    print(f"Creating heightmap ({args.width}x{args.height})...")
-    heightmap: np.ndarray = create_heightmap(
-        polyline, width=args.width, height=args.height
-    )
-
-    # Create metadata dictionary with terrain dimensions
-    metadata = {  # openEXR attributes are camelCase, prefix with ddg to namespace them (DeadDropGames)
-        "ddgTerrainWidth": abs(float(delta_x)),
-        "ddgTerrainHeight": abs(float(delta_y)),
-        "ddgPixelsPerMeter": args.ppm,
-    }
-
-    # save the metadata to a json file in the out directory
-    with open(output_json_path, "w") as f:
-        json.dump(metadata, f, indent=4)
-
-    print(f"Saving heightmap to '{output_exr_path}'...")
-    save_exr(heightmap, output_exr_path, metadata)
-
-    print(f"Done! Heightmap saved to '{output_exr_path}'")
+    generate_heightmap(xs, ys, json_data, output, **options)
 
 
 if __name__ == "__main__":